@@ -22,6 +22,7 @@ setup(
     packages = ['translitbot'],
     scripts = [],
     install_requires = ['pydns', 'dnspython', 'trans', 'sleekxmpp'],
+    extras_require = {'numpy': ['numpy']},
     classifiers = [ # https://pypi.python.org/pypi?%3Aaction=list_classifiers
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
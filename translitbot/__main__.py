@@ -4,5 +4,25 @@
 # Copyright (c) Valentin Fedulov <vasnake@gmail.com>
 # See COPYING for details.
 
-from translitbot.translit_xmpp_bot import main
-main()
+import sys
+import translitbot.logger as logger
+import translitbot.metrics as metrics
+import translitbot.service as service
+from translitbot.translit_xmpp_bot import main, MODES
+logger.setup()
+if not (service.XMPP or service.PORT):
+    sys.exit('configuration error: TRANSBOT_XMPP is 0 and TRANSBOT_HTTP_PORT is not set, nothing to run')
+if metrics.PORT:
+    metrics.serve()
+if service.XMPP:
+    if service.PORT:
+        service.serve()
+    main()
+else:
+    # session store is closed by bot main; without bot close it here, so queued modes are written
+    try:
+        service.serve(block=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        MODES.close()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# (c) Valik mailto:vasnake@gmail.com
+
+u''' Benchmarks for translit encoders and bot responce.
+Every mode from enc.TRANSTABS is run over corpora: short chat lines, long paragraphs,
+mixed latin and cyrillic text, pure ASCII. Reported per case: chars/sec,
+p50/p99 latency per call, memory per call, time of enc module import,
+cost of metrics recorded by bot for one message.
+Result is JSON, two results can be compared to catch regressions between commits.
+
+Run
+$ python -m translitbot.bench -o before.json
+$ git checkout ...
+$ python -m translitbot.bench -o after.json -c before.json
+
+Import time is checked against IMPORTBUDGET only when asked, it depends on machine load
+$ python -m translitbot.bench -o after.json --import-budget
+
+
+Copyright 2012-2014 Valentin Fedulov
+
+This file is part of Translitbot.
+
+Translitbot is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Translitbot is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Translitbot. If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import sys
+import os
+import gc
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import translitbot.enc as enc
+import translitbot.metrics as metrics
+
+CP = enc.CP
+
+TEXT = u"""Съешь же ещё этих мягких французских булок, да выпей чаю.
+В чащах юга жил бы цитрус? Да, но фальшивый экземпляр!
+Широкая электрификация южных губерний даст мощный толчок подъёму сельского хозяйства.
+Любя, съешь щипцы, — вздохнёт мэр, — кайф жгуч.
+Ельцин, Щукин и Цой поехали в Южно-Сахалинск через Йошкар-Олу и Объячево."""
+# realistic text, all letters of alphabet
+
+LATIN = u"""The quick brown fox jumps over the lazy dog.
+See https://github.com/vasnake/transbot/archive/master.zip for sources;
+def main(): return {'ok': True, "count": 42} # code snippet
+Hello, how are you? Fine, thanks!"""
+# realistic ASCII text: english, URL, code
+
+IMPORTBUDGET = 0.05
+# seconds, enc import must not load numpy or compile tables, checked by --import-budget
+
+
+def makeCorpora(seed=1, lines=2000):
+    u""" Return dict {corpus name: list of texts}, generated from TEXT and LATIN
+    by random generator with given seed, so corpora are the same from run to run.
+
+    >>> corpora = makeCorpora(lines=10)
+    >>> sorted(corpora.keys()), len(corpora['chat'])
+    (['ascii', 'chat', 'mixed', 'paragraph'], 10)
+    """
+    rnd = random.Random(seed)
+    ruwords = TEXT.split()
+    enwords = LATIN.split()
+
+    def phrase(words, count):
+        return u' '.join(rnd.choice(words) for _ in range(count))
+
+    return {
+        'chat': [phrase(ruwords, rnd.randint(1, 8)) for _ in range(lines)],
+        'paragraph': [phrase(ruwords, rnd.randint(150, 300)) for _ in range(max(lines // 20, 1))],
+        'mixed': [u' '.join(phrase(rnd.choice((ruwords, enwords)), rnd.randint(1, 4))
+            for _ in range(rnd.randint(1, 6))) for _ in range(lines)],
+        'ascii': [phrase(enwords, rnd.randint(1, 12)) for _ in range(lines)],
+    }
+#def makeCorpora(seed=1, lines=2000):
+
+
+def percentile(values, pct):
+    """ Return pct percentile of sorted list values
+
+    >>> percentile(range(1, 101), 50), percentile(range(1, 101), 99)
+    (50, 99)
+    """
+    if not values:
+        return 0
+    idx = int(round(pct / 100.0 * len(values))) - 1
+    return values[min(max(idx, 0), len(values) - 1)]
+
+
+def measure(func, texts, repeat=3):
+    """ Call func(text) for each text repeat times and return dict with
+    chars/sec, calls, p50 and p99 latency in microseconds and memory per call:
+    result_bytes_per_call - mean size of returned object (sys.getsizeof, items of containers
+    not counted), memory allocated for result on any python;
+    mem_peak_kib - mean peak of memory traced while call runs, result and temporary objects,
+    None if tracemalloc is not available (python 2).
+
+    >>> item = measure(lambda text: [text] * 10, [u'a', u'b'], 1)
+    >>> item['calls'], item['result_bytes_per_call'] == sys.getsizeof([u'a'] * 10)
+    (2, True)
+    """
+    timer = timeit.default_timer
+    latencies = []
+    chars = 0
+    gcold = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for text in texts:
+                started = timer()
+                func(text)
+                latencies.append(timer() - started)
+                chars += len(text)
+
+        size = 0
+        for text in texts:
+            res = func(text)
+            size += 0 if res is None else sys.getsizeof(res)
+
+        peak = None
+        if tracemalloc is not None:
+            peak = 0
+            tracemalloc.start()
+            try:
+                for text in texts:
+                    tracemalloc.clear_traces()
+                    func(text)
+                    peak += tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    finally:
+        if gcold:
+            gc.enable()
+
+    total = sum(latencies)
+    latencies.sort()
+    return {
+        'calls': len(latencies),
+        'chars_per_sec': chars / total if total else 0,
+        'p50_us': percentile(latencies, 50) * 1e6,
+        'p99_us': percentile(latencies, 99) * 1e6,
+        'result_bytes_per_call': float(size) / max(len(texts), 1),
+        'mem_peak_kib': None if peak is None else peak / 1024.0 / max(len(texts), 1),
+    }
+#def measure(func, texts, repeat=3):
+
+
+def benchModes(corpora, repeat=3):
+    """ Return list of results, enc.translit for each mode and corpus
+    """
+    res = []
+    for mode in sorted(enc.TRANSTABS.keys()):
+        for name in sorted(corpora):
+            item = measure(lambda text: enc.translit(text, mode), corpora[name], repeat)
+            item.update({'case': 'translit', 'mode': mode[1], 'corpus': name})
+            res.append(item)
+    return res
+
+
+def benchResponce(corpora, repeat=3):
+    """ Return list of results, bot makeResponce end to end for each corpus,
+    empty list if bot module can't be imported (no sleekxmpp)
+    """
+    try:
+        import translitbot.translit_xmpp_bot as bot
+    except ImportError:
+        return []
+
+    res = []
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        for name in sorted(corpora):
+            item = measure(lambda text: bot.makeResponce(u'bench@localhost', text), corpora[name], repeat)
+            item.update({'case': 'makeResponce', 'mode': enc.DRIVELICMODE[1], 'corpus': name})
+            res.append(item)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return res
+#def benchResponce(corpora, repeat=3):
+
+
+def importTime(repeat=3):
+    """ Return best time in seconds of import translitbot.enc in fresh process,
+    interpreter startup not counted
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([root] + [p for p in [env.get('PYTHONPATH')] if p])
+    code = 'import time; t = time.time(); import translitbot.enc; print(time.time() - t)'
+    return min(float(subprocess.check_output([sys.executable, '-c', code], env=env))
+        for _ in range(repeat))
+#def importTime(repeat=3):
+
+
+def benchMetrics(corpora, repeat=3):
+    """ Return list of results, metrics recorded by bot for one message:
+    counter and three histograms, same calls as in bot
+    """
+    counter = metrics.Counter('bench_messages_total', 'Bench counter', ('result',))
+    hist = metrics.Histogram('bench_seconds', 'Bench histogram')
+    labeled = metrics.Histogram('bench_mode_seconds', 'Bench histogram', ('mode',))
+
+    def record(text):
+        counter.inc(('queued',))
+        started = time.time()
+        labeled.observe(time.time() - started, (enc.DRIVELICMODE[1],))
+        hist.observe(time.time() - started)
+        hist.observe(time.time() - started)
+
+    try:
+        item = measure(record, corpora['chat'], repeat)
+    finally:
+        for name in ('bench_messages_total', 'bench_seconds', 'bench_mode_seconds'):
+            del metrics.REGISTRY[name]
+    item.update({'case': 'metrics', 'mode': enc.DRIVELICMODE[1], 'corpus': 'chat'})
+    return [item]
+#def benchMetrics(corpora, repeat=3):
+
+
+def gitCommit():
+    """ Return current git commit of source tree or None
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    """ Return report lines: chars/sec and p99 change for each case found in both results
+    """
+    key = lambda item: (item['case'], item['mode'], item['corpus'])
+    before = dict((key(item), item) for item in old['results'])
+    res = []
+    for item in new['results']:
+        prev = before.get(key(item))
+        if prev is None or not prev['chars_per_sec']:
+            continue
+        res.append('%-12s %-10s %-10s speed %+6.1f%%  p99 %8.1f -> %8.1f us' % (key(item) + (
+            (item['chars_per_sec'] / prev['chars_per_sec'] - 1) * 100, prev['p99_us'], item['p99_us'])))
+    return res
+
+
+def main(argv=None):
+    """ Parse command line, run benchmarks, write JSON
+    """
+    parser = argparse.ArgumentParser(prog='python -m translitbot.bench',
+        description='Benchmark translit encoders and bot responce.')
+    parser.add_argument('-o', '--output', help='JSON file for results, stdout if omitted')
+    parser.add_argument('-c', '--compare', help='JSON file with previous results to compare with')
+    parser.add_argument('-n', '--lines', type=int, default=2000, help='texts per corpus')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='passes over each corpus')
+    parser.add_argument('--import-budget', action='store_true',
+        help='exit with error if enc import takes longer than %d ms' % (IMPORTBUDGET * 1000))
+    args = parser.parse_args(argv)
+
+    corpora = makeCorpora(lines=args.lines)
+    results = (benchModes(corpora, args.repeat) + benchResponce(corpora, args.repeat) +
+        benchMetrics(corpora, args.repeat))
+    data = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'commit': gitCommit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'import_ms': importTime() * 1000,
+        'results': results,
+    }
+
+    text = json.dumps(data, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as infile:
+            old = json.load(infile)
+        if 'import_ms' in old:
+            sys.stderr.write('import %.1f -> %.1f ms\n' % (old['import_ms'], data['import_ms']))
+        for line in compare(old, data):
+            sys.stderr.write(line + '\n')
+
+    if args.import_budget and data['import_ms'] > IMPORTBUDGET * 1000:
+        sys.stderr.write('import %.1f ms is over budget %d ms\n' % (data['import_ms'], IMPORTBUDGET * 1000))
+        return 1
+    return 0
+#def main(argv=None):
+
+
+if __name__ == "__main__":
+    sys.exit(main())
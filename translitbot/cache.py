@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# (c) Valik mailto:vasnake@gmail.com
+
+u''' Bounded LRU caches for translit results with hit/miss statistics.
+
+Copyright 2012-2014 Valentin Fedulov
+
+This file is part of Translitbot.
+
+Translitbot is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Translitbot is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Translitbot. If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import sys
+import threading
+import collections
+
+import translitbot.enc as enc
+
+
+class LRUCache(object):
+    u""" Thread safe dict-like cache with least recently used eviction.
+    Holds no more than maxEntries items and maxBytes total size of keys and values,
+    size of item computed by sizeof function.
+
+    >>> cache = LRUCache(2)
+    >>> cache['a'] = 1; cache['b'] = 2
+    >>> cache.get('a')
+    1
+    >>> cache['c'] = 3
+    >>> cache.get('b') is None
+    True
+    >>> sorted(cache.stats().items())
+    [('bytes', 0), ('entries', 2), ('evictions', 1), ('hits', 1), ('misses', 1)]
+    """
+
+    def __init__(self, maxEntries=1000, maxBytes=None, sizeof=None):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.sizeof = sizeof or (lambda key, value: 0)
+        self.items = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """ Return cached value for key and mark it as recently used, default if not found
+        """
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.items[key] = value
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        size = self.sizeof(key, value)
+        if self.maxBytes is not None and size > self.maxBytes:
+            return
+        with self.lock:
+            if key in self.items:
+                self.size -= self.sizeof(key, self.items.pop(key))
+            self.items[key] = value
+            self.size += size
+            while len(self.items) > self.maxEntries or (
+                    self.maxBytes is not None and self.size > self.maxBytes):
+                oldkey, oldvalue = self.items.popitem(last=False)
+                self.size -= self.sizeof(oldkey, oldvalue)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self.items)
+
+    def stats(self):
+        """ Return dict with counters: hits, misses, evictions, entries, bytes
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.items), 'bytes': self.size}
+#class LRUCache(object):
+
+
+def textSize(key, value):
+    """ Return approximate memory size of cached (mode, text): result item
+    """
+    return sys.getsizeof(key[1]) + sys.getsizeof(value)
+
+
+class TranslitCache(LRUCache):
+    u""" Memoization of enc.translit keyed on (mode, text).
+    Texts longer than maxLength chars are encoded without cache and counted as bypasses.
+
+    >>> cache = TranslitCache(100, 1024 * 1024)
+    >>> print cache.translit(u'Привет', enc.DRIVELICMODE), cache.translit(u'Привет', enc.DRIVELICMODE)
+    Privet Privet
+    >>> print cache.translit(u'Привет' * 1000, enc.DRIVELICMODE)[:6]
+    Privet
+    >>> stats = cache.stats()
+    >>> stats['hits'], stats['misses'], stats['bypasses'], stats['entries']
+    (1, 1, 1, 1)
+    """
+
+    def __init__(self, maxEntries=1000, maxBytes=None, maxLength=1000):
+        LRUCache.__init__(self, maxEntries, maxBytes, textSize)
+        self.maxLength = maxLength
+        self.bypasses = 0
+
+    def translit(self, inStr, mode):
+        """ Return enc.translit(inStr, mode), cached
+        """
+        if len(inStr) > self.maxLength:
+            with self.lock:
+                self.bypasses += 1
+            return enc.translit(inStr, mode)
+        key = (mode, inStr)
+        res = self.get(key)
+        if res is None:
+            res = enc.translit(inStr, mode)
+            self[key] = res
+        return res
+
+    def stats(self):
+        res = LRUCache.stats(self)
+        with self.lock:
+            res['bypasses'] = self.bypasses
+        return res
+#class TranslitCache(LRUCache):
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# (c) Valik mailto:vasnake@gmail.com
+
+u''' Batch translit of files, directory trees or stdin using enc tables.
+Work is split into blocks of whole lines and blocks are encoded by a pool
+of processes, output is written in input order.
+File that is not valid UTF-8 is reported to stderr and skipped, its partial
+output removed; exit status is 1 if any file was skipped.
+
+Run
+$ python -m translitbot.cli -m driverlic catalog.txt > catalog.lat.txt
+$ python -m translitbot.cli -m iso9sysb -j 8 -p -o export.lat/ export/
+$ cat dump.txt | python -m translitbot.cli -m bgnpcgn > dump.lat.txt
+
+
+Copyright 2012-2014 Valentin Fedulov
+
+This file is part of Translitbot.
+
+Translitbot is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Translitbot is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Translitbot. If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import sys
+import os
+import time
+import argparse
+import itertools
+import threading
+import multiprocessing
+
+import translitbot.enc as enc
+
+CP = enc.CP
+
+BLOCKSIZE = 1024 * 1024
+# bytes of input per one job, block is cut at line end
+
+MODES = enc.modeIndex(enc.TRANSTABS.keys())
+# mode names and unambiguous prefixes, same as bot commands
+
+
+def getMode(name):
+    u""" Return mode tuple ('translation name', 'encoder name') for
+    encoder name, translation name or their unambiguous prefix, None if not found
+
+    >>> print getMode(u'DriverLic')[0]
+    Водительское удостоверение (2000)
+    >>> print getMode(u'ala-lc')[1], getMode(u'bgn')[1], getMode(u'iso')
+    alalc bgnpcgn None
+    """
+    return MODES.get(name.strip().lower())
+#def getMode(name):
+
+
+def iterBlocks(infile, size=BLOCKSIZE):
+    u""" Generator, yield blocks of bytes about size long from infile,
+    each block ends at line end, so UTF-8 chars and words are not split.
+    Empty file gives one empty block.
+
+    >>> import io
+    >>> list(iterBlocks(io.BytesIO(b'ab\\ncd\\nef'), 1))
+    ['ab\\n', 'cd\\n', 'ef']
+    """
+    block = infile.read(size)
+    yield block + infile.readline()
+    while True:
+        block = infile.read(size)
+        if not block:
+            break
+        yield block + infile.readline()
+#def iterBlocks(infile, size=BLOCKSIZE):
+
+
+def listFiles(paths, outdir=None):
+    u""" Return list of (input path, output path) for files and directory trees in paths.
+    Input path '-' means stdin, output path None means stdout.
+    Raise ValueError if two inputs give same output path.
+
+    >>> listFiles(['a/x.txt', 'b/x.txt'], 'out')
+    Traceback (most recent call last):
+    ValueError: b/x.txt and a/x.txt give same output out/x.txt
+    """
+    res = []
+    for path in paths:
+        if path == '-':
+            res.append((path, None))
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    inpath = os.path.join(root, name)
+                    outpath = None
+                    if outdir:
+                        outpath = os.path.join(outdir, os.path.relpath(inpath, path))
+                    res.append((inpath, outpath))
+        else:
+            outpath = os.path.join(outdir, os.path.basename(path)) if outdir else None
+            res.append((path, outpath))
+
+    seen = {}
+    # output path: input path
+    for inpath, outpath in res:
+        if outpath is None:
+            continue
+        key = os.path.normcase(os.path.abspath(outpath))
+        if key in seen:
+            raise ValueError('%s and %s give same output %s' % (inpath, seen[key], outpath))
+        seen[key] = inpath
+    return res
+#def listFiles(paths, outdir=None):
+
+
+def encodeJob(job):
+    u""" Pool worker: return (input path, output path, encoded block, input size, error)
+    for job (mode, input path, output path, block offset, block);
+    encoded block is None and error is message if block is not valid UTF-8
+
+    >>> encodeJob((enc.BGNMODE, 'in.txt', None, 0, u'Цой'.encode(CP)))
+    ('in.txt', None, 'TSoy', 6, None)
+    >>> encodeJob((enc.BGNMODE, 'in.txt', None, 10, 'ok \\xd0'))[2:4]
+    (None, 4)
+    """
+    mode, inpath, outpath, offset, block = job
+    try:
+        return (inpath, outpath, enc.translit_bytes(block, mode), len(block), None)
+    except UnicodeDecodeError as err:
+        return (inpath, outpath, None, len(block), 'not valid UTF-8 in block at byte %d (%s)' % (offset, err))
+
+
+def iterJobs(files, mode, blocksize=BLOCKSIZE):
+    """ Generator, yield jobs for encodeJob from all files
+    """
+    for inpath, outpath in files:
+        if inpath == '-':
+            infile = sys.stdin
+        else:
+            infile = open(inpath, 'rb')
+        try:
+            offset = 0
+            for block in iterBlocks(infile, blocksize):
+                yield (mode, inpath, outpath, offset, block)
+                offset += len(block)
+        finally:
+            if infile is not sys.stdin:
+                infile.close()
+#def iterJobs(files, mode, blocksize=BLOCKSIZE):
+
+
+def bounded(jobs, semaphore):
+    """ Generator, yield jobs, no more than semaphore value ahead of consumer.
+    Pool.imap reads jobs in separate thread as fast as it can, it has to wait.
+    """
+    for job in jobs:
+        semaphore.acquire()
+        yield job
+
+
+class Progress(object):
+    """ Progress report to stderr: input bytes done, total and speed
+    """
+
+    def __init__(self, total, enabled=True):
+        self.total = total
+        self.enabled = enabled
+        self.done = 0
+        self.started = time.time()
+        self.shown = 0
+
+    def update(self, size, force=False):
+        self.done += size
+        now = time.time()
+        if not self.enabled or (now - self.shown < 1 and not force):
+            return
+        self.shown = now
+        speed = self.done / max(now - self.started, 1e-6) / 1024 / 1024
+        if self.total:
+            sys.stderr.write('\r%.1f of %.1f MB, %.1f MB/s ' % (
+                self.done / 1048576.0, self.total / 1048576.0, speed))
+        else:
+            sys.stderr.write('\r%.1f MB, %.1f MB/s ' % (self.done / 1048576.0, speed))
+        sys.stderr.flush()
+#class Progress(object):
+
+
+def run(files, mode, jobs=None, progress=False, blocksize=BLOCKSIZE):
+    """ Translit files [(input path, output path), ...] according given mode,
+    using jobs processes. Return list of input paths skipped as not valid UTF-8.
+    """
+    total = sum(os.path.getsize(inpath) for inpath, outpath in files if inpath != '-')
+    if any(inpath == '-' for inpath, outpath in files):
+        total = 0
+    report = Progress(total, progress)
+    # compile encoder before fork, so workers share it
+    enc.getEncoder(mode[1])
+    semaphore = threading.Semaphore((jobs or multiprocessing.cpu_count()) * 4)
+    tasks = bounded(iterJobs(files, mode, blocksize), semaphore)
+
+    pool = None
+    if jobs == 1:
+        results = itertools.imap(encodeJob, tasks)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(encodeJob, tasks)
+
+    outfile, current = (None, None)
+    failed = []
+    try:
+        for inpath, outpath, data, size, error in results:
+            report.update(size)
+            semaphore.release()
+            if failed and failed[-1] == inpath:
+                continue
+            if error is not None:
+                failed.append(inpath)
+                sys.stderr.write('%s: %s, skipped\n' % (inpath, error))
+                if outpath is not None and outpath == current:
+                    outfile.close()
+                    os.remove(outpath)
+                    outfile, current = (None, None)
+                continue
+            if outfile is None or outpath != current:
+                if outfile is not None and outfile is not sys.stdout:
+                    outfile.close()
+                current = outpath
+                if outpath is None:
+                    outfile = sys.stdout
+                else:
+                    if not os.path.isdir(os.path.dirname(outpath) or '.'):
+                        os.makedirs(os.path.dirname(outpath))
+                    outfile = open(outpath, 'wb')
+            outfile.write(data)
+        report.update(0, True)
+        if pool is not None:
+            pool.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if outfile is not None and outfile is not sys.stdout:
+            outfile.close()
+        if pool is not None:
+            pool.join()
+        if progress:
+            sys.stderr.write('\n')
+    return failed
+#def run(files, mode, jobs=None, progress=False, blocksize=BLOCKSIZE):
+
+
+def main(argv=None):
+    """ Parse command line and run
+    """
+    parser = argparse.ArgumentParser(prog='python -m translitbot.cli',
+        description='Translit files, directory trees or stdin.')
+    parser.add_argument('paths', nargs='*', default=['-'],
+        help="files or directories, '-' or nothing for stdin")
+    parser.add_argument('-m', '--mode', default=enc.DRIVELICMODE[1],
+        help='encoder or its unambiguous prefix: %s' % ', '.join(
+            sorted(enccode for encname, enccode in enc.TRANSTABS.keys())))
+    parser.add_argument('-o', '--output',
+        help='output directory, stdout if omitted')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+        help='number of processes, default is number of CPU')
+    parser.add_argument('-p', '--progress', action='store_true',
+        help='report progress to stderr')
+    args = parser.parse_args(argv)
+
+    mode = getMode(args.mode.decode(CP) if isinstance(args.mode, str) else args.mode)
+    if mode is None:
+        parser.error('unknown mode: %s' % args.mode)
+    if args.jobs < 1:
+        parser.error('jobs must be positive')
+
+    try:
+        files = listFiles(args.paths, args.output)
+    except ValueError as err:
+        parser.error(str(err))
+    return 1 if run(files, mode, args.jobs, args.progress) else 0
+#def main(argv=None):
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        sys.exit(1)
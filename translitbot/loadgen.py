@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# (c) Valik mailto:vasnake@gmail.com
+
+u''' Load generator for bot without XMPP server and network.
+Message stanzas of many simulated users are injected into TranslitBot event queue
+at given rate, with text sizes taken from given distribution; replies are caught
+on send, so the whole path is measured: event dispatch, rate limit, pipeline queues,
+workers, translit, reply stanza. Reported: end to end reply latency percentiles,
+throughput, replies by kind, pipeline stats.
+Latency is counted from scheduled send time to first part of reply, so stalls of injector
+are not hidden.
+
+Run
+$ python -m translitbot.loadgen -n 20000 -u 5000 -r 2000 -s 20:90,300:9,3000:1 -w 8
+$ python -m translitbot.loadgen -o before.json
+$ python -m translitbot.loadgen -o after.json -c before.json
+
+
+Copyright 2012-2014 Valentin Fedulov
+
+This file is part of Translitbot.
+
+Translitbot is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Translitbot is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Translitbot. If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from xml.sax.saxutils import escape
+
+from sleekxmpp.xmlstream import ET
+
+import translitbot.bench as bench
+import translitbot.pipeline as pipeline
+import translitbot.ratelimit as ratelimit
+import translitbot.translit_xmpp_bot as bot
+
+BOTJID = u'bot@loadgen.local'
+# bot account, simulated users are user<N>@loadgen.local
+
+SIZES = u'20:90,300:9,3000:1'
+# default text sizes distribution, chars:weight
+
+
+def parseSizes(text):
+    u""" Return list of (chars, weight) from 'chars:weight,...' text
+
+    >>> parseSizes(u'20:90,300:9,3000')
+    [(20, 90.0), (300, 9.0), (3000, 1.0)]
+    """
+    res = []
+    for item in text.split(u','):
+        size, _, weight = item.partition(u':')
+        res.append((int(size), float(weight or 1)))
+    return res
+
+
+def makeMessages(count, users, sizes, seed=1):
+    u""" Return list of (jid, text) for count messages from users simulated JIDs,
+    text lengths picked from sizes [(chars, weight), ...], texts made of bench.TEXT words.
+    Same seed gives same messages.
+
+    >>> msgs = makeMessages(3, 2, [(10, 1)])
+    >>> [(jid, len(text)) for jid, text in msgs]
+    [(u'user0@loadgen.local', 10), (u'user1@loadgen.local', 10), (u'user0@loadgen.local', 10)]
+    """
+    rnd = random.Random(seed)
+    words = bench.TEXT.split()
+    total = sum(weight for size, weight in sizes)
+    res = []
+    for num in range(count):
+        point = rnd.uniform(0, total)
+        for size, weight in sizes:
+            point -= weight
+            if point <= 0:
+                break
+        text = []
+        length = 0
+        while length < size:
+            word = rnd.choice(words)
+            length += len(word) + (1 if text else 0)
+            text.append(word)
+        res.append((u'user%d@loadgen.local' % (num % users), u' '.join(text)[:size]))
+    return res
+#def makeMessages(count, users, sizes, seed=1):
+
+
+class LoadBot(bot.TranslitBot):
+    u""" TranslitBot without connection: stanzas sent by bot are serialized
+    and recorded as replies {thread: (time, body)} instead of writing to socket.
+    Reply keeps thread of message, so thread is used as message id.
+    Long answer is sent in parts, first part is recorded, parts are counted.
+    """
+
+    def __init__(self):
+        bot.TranslitBot.__init__(self, BOTJID, u'')
+        self.replies = {}
+        self.parts = 0
+        self.repliesLock = threading.Lock()
+        self.online = True
+
+    def send(self, data, mask=None, timeout=None, now=False, use_filters=True):
+        stamp = time.time()
+        str(data)
+        if data.name == 'message':
+            with self.repliesLock:
+                self.replies.setdefault(data['thread'], (stamp, data['body']))
+                self.parts += 1
+
+    def inject(self, msgid, jid, text):
+        """ Put message stanza from jid to event queue, as stream reader does
+        """
+        xml = ET.fromstring((u"<message xmlns='jabber:client' from='%s/loadgen' to='%s' "
+            u"type='chat'><thread>%s</thread><body>%s</body></message>" % (
+            jid, BOTJID, msgid, escape(text))).encode('utf-8'))
+        self.event('message', self.Message(xml=xml))
+#class LoadBot(bot.TranslitBot):
+
+
+def replyKind(body):
+    """ Return kind of reply by its text: answer, busy, ratelimit, toolong
+
+    >>> replyKind(bot.BUSYTEXT), replyKind(u"Mode 'gostr', answer is:")
+    ('busy', 'answer')
+    """
+    if body == bot.BUSYTEXT:
+        return 'busy'
+    if body.startswith(bot.RATETEXT.split(u'%')[0]):
+        return 'ratelimit'
+    if body.startswith(bot.SIZETEXT.split(u'%')[0]):
+        return 'toolong'
+    return 'answer'
+
+
+def run(messages, rate=0, workers=bot.WORKERS, queue=bot.QUEUE, policy=bot.OVERLOAD,
+        limit=True, timeout=60):
+    """ Inject messages [(jid, text), ...] into LoadBot, rate messages per second
+    (0: as fast as possible), wait for replies up to timeout seconds.
+    Return dict with results.
+    """
+    xmpp = LoadBot()
+    xmpp.pipeline.stop()
+    xmpp.pipeline = pipeline.Pipeline(xmpp.reply, workers, queue, policy, xmpp.busy)
+    if not limit:
+        xmpp.limiter = ratelimit.RateLimiter(float('inf'), sys.maxint)
+    injected = threading.Event()
+    xmpp.add_event_handler('loadgen_done', lambda event: injected.set())
+    runner = threading.Thread(target=xmpp._event_runner, name='loadgen.events')
+    runner.daemon = True
+    runner.start()
+
+    scheduled = {}
+    started = time.time()
+    for num, (jid, text) in enumerate(messages):
+        msgid = u'lg%d' % num
+        due = started + float(num) / rate if rate else time.time()
+        pause = due - time.time()
+        if pause > 0:
+            time.sleep(pause)
+        scheduled[msgid] = due
+        xmpp.inject(msgid, jid, text)
+    sent = time.time()
+
+    # events are dispatched in order, marker comes after last message
+    xmpp.event('loadgen_done')
+    injected.wait(timeout)
+    xmpp.pipeline.stop()
+    finished = time.time()
+    xmpp.stop.set()
+    xmpp.event_queue.put(None)
+
+    kinds = {}
+    latencies = []
+    for msgid, (stamp, body) in xmpp.replies.items():
+        kind = replyKind(body)
+        kinds[kind] = kinds.get(kind, 0) + 1
+        if kind == 'answer':
+            latencies.append(stamp - scheduled[msgid])
+    latencies.sort()
+    stats = xmpp.pipeline.stats()
+    return {
+        'messages': len(messages),
+        'users': len(set(jid for jid, text in messages)),
+        'chars': sum(len(text) for jid, text in messages),
+        'rate': rate,
+        'workers': workers, 'queue': queue, 'policy': policy, 'limit': limit,
+        'send_rate': len(messages) / max(sent - started, 1e-9),
+        'throughput': kinds.get('answer', 0) / max(finished - started, 1e-9),
+        'replies': kinds,
+        'noreply': len(messages) - len(xmpp.replies),
+        'parts': xmpp.parts,
+        'p50_ms': bench.percentile(latencies, 50) * 1000,
+        'p90_ms': bench.percentile(latencies, 90) * 1000,
+        'p99_ms': bench.percentile(latencies, 99) * 1000,
+        'max_ms': (latencies[-1] if latencies else 0) * 1000,
+        'wait_mean_ms': stats['wait_mean'] * 1000,
+        'wait_max_ms': stats['wait_max'] * 1000,
+    }
+#def run(messages, rate=0, workers=bot.WORKERS, queue=bot.QUEUE, policy=bot.OVERLOAD,
+
+
+def compare(old, new):
+    """ Return report lines: throughput and latency change
+    """
+    res = ['throughput %8.1f -> %8.1f msg/s (%+.1f%%)' % (old['throughput'], new['throughput'],
+        (new['throughput'] / old['throughput'] - 1) * 100 if old['throughput'] else 0)]
+    for key in ('p50_ms', 'p90_ms', 'p99_ms', 'max_ms'):
+        res.append('%-10s %8.1f -> %8.1f ms' % (key, old[key], new[key]))
+    return res
+
+
+def main(argv=None):
+    """ Parse command line, run load, write JSON
+    """
+    parser = argparse.ArgumentParser(prog='python -m translitbot.loadgen',
+        description='Load bot with simulated users, measure reply latency and throughput.')
+    parser.add_argument('-n', '--messages', type=int, default=10000, help='messages to send')
+    parser.add_argument('-u', '--users', type=int, default=1000, help='simulated JIDs')
+    parser.add_argument('-r', '--rate', type=float, default=1000,
+        help='messages per second, 0 for as fast as possible')
+    parser.add_argument('-s', '--sizes', default=SIZES,
+        help='text sizes distribution, chars:weight,... (default %(default)s)')
+    parser.add_argument('-w', '--workers', type=int, default=bot.WORKERS, help='pipeline workers')
+    parser.add_argument('-q', '--queue', type=int, default=bot.QUEUE, help='queue size of worker')
+    parser.add_argument('-p', '--policy', default=bot.OVERLOAD, choices=pipeline.POLICIES,
+        help='overload policy')
+    parser.add_argument('--nolimit', action='store_true', help='no rate limit for users')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for messages')
+    parser.add_argument('-o', '--output', help='JSON file for results, stdout if omitted')
+    parser.add_argument('-c', '--compare', help='JSON file with previous results to compare with')
+    args = parser.parse_args(argv)
+
+    messages = makeMessages(args.messages, args.users, parseSizes(args.sizes), args.seed)
+    data = run(messages, args.rate, args.workers, args.queue, args.policy, not args.nolimit)
+    data.update({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': bench.gitCommit(),
+        'sizes': args.sizes})
+
+    text = json.dumps(data, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as infile:
+            old = json.load(infile)
+        for line in compare(old, data):
+            sys.stderr.write(line + '\n')
+    return 0
+#def main(argv=None):
+
+
+if __name__ == "__main__":
+    sys.exit(main())
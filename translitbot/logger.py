@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# (c) Valik mailto:vasnake@gmail.com
+
+u''' Buffered logging: records are put to bounded queue and written
+by background thread, so message handling doesn't wait for console or disk.
+Texts of messages are not logged by default, they can be sampled and truncated.
+
+Setup from environment
+TRANSBOT_LOG_LEVEL=INFO       # DEBUG for each message
+TRANSBOT_LOG_FILE=bot.log     # stderr if empty
+TRANSBOT_LOG_PAYLOAD=0.01     # part of message texts logged, 0 by default
+TRANSBOT_LOG_MAXLEN=200       # logged text length limit
+
+
+Copyright 2012-2014 Valentin Fedulov
+
+This file is part of Translitbot.
+
+Translitbot is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Translitbot is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Translitbot. If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import sys
+import random
+import atexit
+import logging
+import threading
+import Queue
+
+LEVEL = os.environ.get("TRANSBOT_LOG_LEVEL", "INFO")
+LOGFILE = os.environ.get("TRANSBOT_LOG_FILE", "")
+PAYLOAD = float(os.environ.get("TRANSBOT_LOG_PAYLOAD", "0"))
+MAXLEN = int(os.environ.get("TRANSBOT_LOG_MAXLEN", "200"))
+
+FORMAT = u'%(asctime)s %(levelname)s %(name)s: %(message)s'
+QUEUESIZE = 10000
+# records waiting for writer, new records are dropped if queue is full
+
+logging.getLogger('translitbot').addHandler(logging.NullHandler())
+
+
+class Payload(object):
+    u""" Lazy log argument for message text: text is shown for PAYLOAD part
+    of records and cut to MAXLEN chars, otherwise only its length.
+    Decision made when record is written, not when it is logged.
+
+    >>> print Payload(u'secret', 0)
+    <6 chars>
+    >>> print Payload(u'secret text', 1, 6)
+    'secret...'
+    """
+
+    def __init__(self, text, sample=None, maxlen=None):
+        self.text = text
+        self.sample = PAYLOAD if sample is None else sample
+        self.maxlen = MAXLEN if maxlen is None else maxlen
+
+    def __unicode__(self):
+        if not self.sample or random.random() >= self.sample:
+            return u'<%d chars>' % len(self.text)
+        if len(self.text) > self.maxlen:
+            return u"'%s...'" % self.text[:self.maxlen]
+        return u"'%s'" % self.text
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+#class Payload(object):
+
+
+class AsyncHandler(logging.Handler):
+    u""" Handler putting records to queue, background thread formats
+    and writes them to stream as UTF-8 lines, flushes stream when queue is empty.
+    """
+
+    def __init__(self, stream, maxsize=QUEUESIZE):
+        logging.Handler.__init__(self)
+        self.stream = stream
+        self.queue = Queue.Queue(maxsize)
+        self.dropped = 0
+        self.writer = threading.Thread(target=self.writeLoop, name='AsyncHandler.writer')
+        self.writer.daemon = True
+        self.writer.start()
+
+    def emit(self, record):
+        if record.exc_info:
+            # traceback objects are not kept, format it now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def writeLoop(self):
+        """ Writer thread: write records until None
+        """
+        while True:
+            record = self.queue.get()
+            if record is None:
+                self.stream.flush()
+                return
+            try:
+                text = self.format(record)
+                if isinstance(text, unicode):
+                    text = text.encode('utf-8')
+                self.stream.write(text + '\n')
+                if self.queue.empty():
+                    self.stream.flush()
+            except Exception:
+                self.handleError(record)
+
+    def close(self):
+        """ Write queued records and stop writer
+        """
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+        logging.Handler.close(self)
+#class AsyncHandler(logging.Handler):
+
+
+def setup(level=LEVEL, logfile=LOGFILE):
+    """ Add AsyncHandler to 'translitbot' logger, return handler.
+    Log is written to logfile or stderr.
+    """
+    stream = open(logfile, 'ab') if logfile else sys.stderr
+    handler = AsyncHandler(stream)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    root = logging.getLogger('translitbot')
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, basestring) else level)
+    atexit.register(handler.close)
+    return handler
+#def setup(level=LEVEL, logfile=LOGFILE):
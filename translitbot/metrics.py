@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# (c) Valik mailto:vasnake@gmail.com
+
+u''' Counters, gauges and latency histograms in Prometheus text format,
+served by local HTTP listener.
+
+Run
+$ export TRANSBOT_METRICS_PORT=9108
+$ python -m translitbot
+$ curl http://127.0.0.1:9108/metrics
+
+
+Copyright 2012-2014 Valentin Fedulov
+
+This file is part of Translitbot.
+
+Translitbot is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Translitbot is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Translitbot. If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import bisect
+import logging
+import threading
+import wsgiref.simple_server
+
+PORT = int(os.environ.get("TRANSBOT_METRICS_PORT", "0"))
+HOST = os.environ.get("TRANSBOT_METRICS_HOST", "127.0.0.1")
+# listener address, no listener if port is 0
+
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+# histogram upper bounds, seconds
+
+REGISTRY = {}
+# 'metric name' : metric object, see render
+
+LOG = logging.getLogger(__name__)
+
+
+def labelText(names, values):
+    u""" Return Prometheus labels text for names and values
+
+    >>> print labelText(('mode', 'le'), ('gostr', 0.5))
+    {mode="gostr",le="0.5"}
+    """
+    if not names:
+        return u''
+    return u'{%s}' % u','.join(u'%s="%s"' % (name, unicode(value).replace(u'\\', u'\\\\').replace(u'"', u'\\"'))
+        for name, value in zip(names, values))
+
+
+class Counter(object):
+    u""" Counter with optional labels, registered in REGISTRY by name
+
+    >>> counter = Counter('doctest_total', 'Doctest counter', ('mode',))
+    >>> counter.inc(('gostr',)); counter.inc(('gostr',), 2)
+    >>> print u'\\n'.join(counter.render())
+    # HELP doctest_total Doctest counter
+    # TYPE doctest_total counter
+    doctest_total{mode="gostr"} 3
+    """
+    kind = 'counter'
+
+    def __init__(self, name, helptext, labels=()):
+        self.name = name
+        self.helptext = helptext
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def header(self):
+        return [u'# HELP %s %s' % (self.name, self.helptext), u'# TYPE %s %s' % (self.name, self.kind)]
+
+    def render(self):
+        """ Return list of text lines
+        """
+        with self.lock:
+            items = sorted(self.values.items())
+        return self.header() + [u'%s%s %s' % (self.name, labelText(self.labels, labels), value)
+            for labels, value in items]
+#class Counter(object):
+
+
+class Gauge(Counter):
+    u""" Value taken from func() when rendered
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, helptext, func):
+        Counter.__init__(self, name, helptext)
+        self.func = func
+
+    def render(self):
+        return self.header() + [u'%s %s' % (self.name, self.func())]
+
+
+class Histogram(Counter):
+    u""" Histogram of observed values with cumulative buckets, sum and count
+
+    >>> hist = Histogram('doctest_seconds', 'Doctest histogram', buckets=(0.1, 1))
+    >>> hist.observe(0.05); hist.observe(0.5); hist.observe(5)
+    >>> print u'\\n'.join(hist.render()[2:])
+    doctest_seconds_bucket{le="0.1"} 1
+    doctest_seconds_bucket{le="1"} 2
+    doctest_seconds_bucket{le="+Inf"} 3
+    doctest_seconds_sum 5.55
+    doctest_seconds_count 3
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, helptext, labels=(), buckets=BUCKETS):
+        Counter.__init__(self, name, helptext, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[idx] += 1
+            counts[-1] += value
+
+    def render(self):
+        with self.lock:
+            items = sorted((labels, list(counts)) for labels, counts in self.values.items())
+        res = self.header()
+        names = self.labels + ('le',)
+        for labels, counts in items:
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                res.append(u'%s_bucket%s %d' % (self.name, labelText(names, labels + (bound,)), total))
+            res.append(u'%s_sum%s %r' % (self.name, labelText(self.labels, labels), counts[-1]))
+            res.append(u'%s_count%s %d' % (self.name, labelText(self.labels, labels), total))
+        return res
+#class Histogram(Counter):
+
+
+def render():
+    """ Return all registered metrics in Prometheus text format
+    """
+    lines = []
+    for name in sorted(REGISTRY):
+        lines.extend(REGISTRY[name].render())
+    return u'\n'.join(lines) + u'\n'
+
+
+def application(environ, start_response):
+    """ WSGI application: metrics on /metrics, 404 for other paths
+    """
+    if environ.get('PATH_INFO') != '/metrics':
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return ['not found\n']
+    body = render().encode('utf-8')
+    start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+        ('Content-Length', str(len(body)))])
+    return [body]
+
+
+class QuietHandler(wsgiref.simple_server.WSGIRequestHandler):
+    """ Request handler without access log on stderr
+    """
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=PORT, host=HOST):
+    """ Start HTTP listener in background thread, return server
+    """
+    server = wsgiref.simple_server.make_server(host, port, application, handler_class=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics')
+    thread.daemon = True
+    thread.start()
+    LOG.info(u'metrics on http://%s:%s/metrics', host, server.server_port)
+    return server
+#def serve(port=PORT, host=HOST):
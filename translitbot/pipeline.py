@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# (c) Valik mailto:vasnake@gmail.com
+
+u''' Message pipeline: bounded queues served by pool of worker threads.
+Messages of one user go to one worker, so replies keep user's order,
+while long message of one user doesn't stall others.
+Worker takes messages of its users in turn, so flood of one user
+doesn't delay messages of others.
+
+Copyright 2012-2014 Valentin Fedulov
+
+This file is part of Translitbot.
+
+Translitbot is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Translitbot is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Translitbot. If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import time
+import zlib
+import logging
+import threading
+import collections
+import Queue
+
+DROP = 'drop'
+# overload policy: forget message
+DEFER = 'defer'
+# overload policy: sender waits for free slot up to deferTimeout, then busy
+BUSY = 'busy'
+# overload policy: call onBusy for message
+POLICIES = (DROP, DEFER, BUSY)
+
+LOG = logging.getLogger(__name__)
+
+
+class FairQueue(object):
+    u""" Bounded queue of (user, task) with round-robin get over users:
+    each user has own FIFO, get takes task of next user in turn.
+    Interface follows Queue.Queue: put raises Queue.Full, get blocks.
+    get returns None after close when queue is empty.
+
+    >>> queue = FairQueue(10)
+    >>> for user, task in [('a', 1), ('a', 2), ('a', 3), ('b', 1), ('c', 1)]:
+    ...     queue.put(user, task)
+    >>> queue.close()
+    >>> [queue.get() for _ in range(6)]
+    [1, 1, 1, 2, 3, None]
+    """
+
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self.users = collections.OrderedDict()
+        self.size = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def put(self, user, task, block=True, timeout=None):
+        """ Add task of user, wait for free slot up to timeout seconds if block
+        """
+        with self.cond:
+            if self.maxsize > 0 and self.size >= self.maxsize:
+                if not block:
+                    raise Queue.Full
+                deadline = None if timeout is None else time.time() + timeout
+                while self.size >= self.maxsize:
+                    left = None if deadline is None else deadline - time.time()
+                    if left is not None and left <= 0:
+                        raise Queue.Full
+                    self.cond.wait(left)
+            self.users.setdefault(user, collections.deque()).append(task)
+            self.size += 1
+            self.cond.notify_all()
+
+    def put_nowait(self, user, task):
+        self.put(user, task, False)
+
+    def get(self):
+        """ Return task of next user in turn, wait for it if queue is empty
+        """
+        with self.cond:
+            while not self.size:
+                if self.closed:
+                    return None
+                self.cond.wait()
+            user, tasks = self.users.popitem(last=False)
+            task = tasks.popleft()
+            if tasks:
+                self.users[user] = tasks
+            self.size -= 1
+            self.cond.notify_all()
+            return task
+
+    def qsize(self):
+        return self.size
+
+    def close(self):
+        """ Wake up waiting get calls, they return None when queue is empty
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+#class FairQueue(object):
+
+
+class Pipeline(object):
+    u""" Pool of workers calling handler(user, item) for submitted items.
+    Each worker has queue of maxQueue items, user is bound to worker by hash of name.
+    If queue is full, item is handled by overload policy.
+
+    >>> done = []
+    >>> pipe = Pipeline(lambda user, item: done.append((user, item)), workers=2, maxQueue=10)
+    >>> for i in range(5):
+    ...     pipe.submit(u'a@example.com', i)
+    True
+    True
+    True
+    True
+    True
+    >>> pipe.stop()
+    >>> [item for user, item in done]
+    [0, 1, 2, 3, 4]
+    >>> stats = pipe.stats()
+    >>> stats['processed'], stats['depth'], stats['dropped']
+    (5, 0, 0)
+    """
+
+    def __init__(self, handler, workers=4, maxQueue=1000, policy=BUSY, onBusy=None, deferTimeout=5.0):
+        if policy not in POLICIES:
+            raise ValueError(u'unknown overload policy: %s' % policy)
+        self.handler = handler
+        self.policy = policy
+        self.onBusy = onBusy
+        self.deferTimeout = deferTimeout
+        self.queues = [FairQueue(maxQueue) for _ in range(max(workers, 1))]
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.dropped = 0
+        self.busy = 0
+        self.waitTotal = 0.0
+        self.waitMax = 0.0
+        self.threads = []
+        for num, queue in enumerate(self.queues):
+            thread = threading.Thread(target=self.work, args=(queue,), name='Pipeline.worker%d' % num)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, user, item):
+        """ Put item of user to queue, return False if it was not queued
+        because of overload
+        """
+        queue = self.queues[zlib.crc32(user.encode('utf-8')) % len(self.queues)]
+        task = (time.time(), user, item)
+        try:
+            if self.policy == DEFER:
+                queue.put(user, task, True, self.deferTimeout)
+            else:
+                queue.put_nowait(user, task)
+            return True
+        except Queue.Full:
+            pass
+
+        with self.lock:
+            if self.policy == DROP:
+                self.dropped += 1
+            else:
+                self.busy += 1
+        if self.policy != DROP and self.onBusy is not None:
+            self.onBusy(user, item)
+        return False
+    #def submit(self, user, item):
+
+    def work(self, queue):
+        """ Worker thread: handle items from queue until it is closed
+        """
+        while True:
+            task = queue.get()
+            if task is None:
+                return
+            queued, user, item = task
+            wait = time.time() - queued
+            try:
+                self.handler(user, item)
+            except:
+                LOG.exception(u'Pipeline.work failed')
+            with self.lock:
+                self.processed += 1
+                self.waitTotal += wait
+                self.waitMax = max(self.waitMax, wait)
+    #def work(self, queue):
+
+    def stop(self):
+        """ Handle queued items and stop workers
+        """
+        for queue in self.queues:
+            queue.close()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def stats(self):
+        """ Return dict with counters: depth (queued items), processed, dropped, busy,
+        mean and max wait in queue, seconds
+        """
+        with self.lock:
+            return {'depth': sum(queue.qsize() for queue in self.queues),
+                'processed': self.processed, 'dropped': self.dropped, 'busy': self.busy,
+                'wait_mean': self.waitTotal / self.processed if self.processed else 0.0,
+                'wait_max': self.waitMax}
+#class Pipeline(object):
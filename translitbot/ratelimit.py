@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# (c) Valik mailto:vasnake@gmail.com
+
+u''' Per-user rate limit by token bucket.
+
+Copyright 2012-2014 Valentin Fedulov
+
+This file is part of Translitbot.
+
+Translitbot is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Translitbot is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Translitbot. If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import time
+import threading
+
+import translitbot.cache as cache
+
+
+class RateLimiter(object):
+    u""" Token bucket for each user: bucket holds up to burst tokens,
+    refilled by rate tokens per second, each message takes one token.
+    Buckets of no more than maxEntries recently seen users are kept,
+    forgotten user starts with full bucket.
+
+    >>> limiter = RateLimiter(rate=1, burst=2)
+    >>> [limiter.take(u'a@example.com', now=100)[0] for _ in range(3)]
+    [0.0, 0.0, 1.0]
+    >>> limiter.take(u'a@example.com', now=100)
+    (1.0, 2)
+    >>> limiter.take(u'a@example.com', now=101), limiter.take(u'b@example.com', now=101)
+    ((0.0, 0), (0.0, 0))
+    """
+
+    def __init__(self, rate=1.0, burst=5, maxEntries=10000):
+        self.rate = float(rate)
+        self.burst = burst
+        self.buckets = cache.LRUCache(maxEntries)
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def take(self, user, now=None):
+        """ Take token from user bucket. Return (seconds to wait, rejected in a row),
+        wait is 0.0 if message is allowed
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            tokens, stamp, inrow = self.buckets.get(user) or (self.burst, now, 0)
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            if tokens >= 1:
+                self.buckets[user] = (tokens - 1, now, 0)
+                return (0.0, 0)
+            self.buckets[user] = (tokens, now, inrow + 1)
+            self.rejected += 1
+            return ((1 - tokens) / self.rate, inrow + 1)
+    #def take(self, user, now=None):
+
+    def stats(self):
+        """ Return dict with counters: users (buckets kept), rejected (messages)
+        """
+        return {'users': len(self.buckets), 'rejected': self.rejected}
+#class RateLimiter(object):
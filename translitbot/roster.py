@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# (c) Valik mailto:vasnake@gmail.com
+
+u''' Roster cache in sqlite file for sleekxmpp roster (XEP-0237 roster versioning).
+Roster and its version survive restart, so server sends only changes
+instead of full roster on each session start.
+
+Copyright 2012-2014 Valentin Fedulov
+
+This file is part of Translitbot.
+
+Translitbot is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Translitbot is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Translitbot. If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import json
+import sqlite3
+import threading
+
+COMMITEVERY = 1000
+# saved items per transaction while roster is loading
+
+
+class RosterStore(object):
+    u""" Datastore interface for sleekxmpp roster: entries, load, save, version, set_version.
+    Items of owner are read from file by one query and kept in memory,
+    saves are committed in batches and on close.
+    Version set by sleekxmpp before items of roster result are saved is held in memory
+    and written along with items by commitVersion, when whole result is applied;
+    so file stopped in the middle of load keeps old version and server sends full changes again.
+    After close calls are ignored, so roster handler thread still running
+    can't write to closed file.
+
+    >>> import tempfile, shutil
+    >>> tmpdir = tempfile.mkdtemp()
+    >>> store = RosterStore(os.path.join(tmpdir, 'roster.sqlite'))
+    >>> store.set_version(u'bot@example.com', u'v1')
+    >>> store.save(u'bot@example.com', u'a@example.com', {'name': u'A', 'groups': []}, {})
+    >>> store.commitVersion(u'bot@example.com')
+    >>> store.set_version(u'bot@example.com', u'v2')
+    >>> store.save(u'bot@example.com', u'b@example.com', {'name': u'B', 'groups': []}, {})
+    >>> store.close()
+    >>> store = RosterStore(os.path.join(tmpdir, 'roster.sqlite'))
+    >>> store.entries(None), sorted(store.entries(u'bot@example.com')), store.version(u'bot@example.com')
+    ([u'bot@example.com'], [u'a@example.com', u'b@example.com'], u'v1')
+    >>> store.load(u'bot@example.com', u'a@example.com', {})['name']
+    u'A'
+    >>> store.close(); store.close()
+    >>> store.save(u'bot@example.com', u'b@example.com', {'name': u'B', 'groups': []}, {})
+    >>> store.entries(u'bot@example.com'), store.load(u'bot@example.com', u'a@example.com', {})
+    ([], None)
+    >>> shutil.rmtree(tmpdir)
+    """
+
+    def __init__(self, path):
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('create table if not exists roster (owner text, jid text, state text, '
+            'primary key (owner, jid))')
+        self.db.execute('create table if not exists versions (owner text primary key, ver text)')
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.items = {}
+        self.unsaved = 0
+        self.versions = {}
+        # owner: version not written yet, see commitVersion
+        self.closed = False
+
+    def entries(self, owner, default=None):
+        """ Return list of owners if owner is None, else list of jids in owner roster
+        """
+        with self.lock:
+            if self.closed:
+                return []
+            if owner is None:
+                return [row[0] for row in self.db.execute('select distinct owner from roster')]
+            return self.ownerItems(owner).keys()
+
+    def ownerItems(self, owner):
+        """ Return dict {jid: state} of owner, read from file on first call
+        """
+        owner = unicode(owner)
+        if owner not in self.items:
+            self.items[owner] = dict((jid, json.loads(state)) for jid, state in
+                self.db.execute('select jid, state from roster where owner = ?', (owner,)))
+        return self.items[owner]
+
+    def load(self, owner, jid, db_state):
+        """ Return saved state of roster item, None if not found
+        """
+        with self.lock:
+            if self.closed:
+                return None
+            return self.ownerItems(owner).get(unicode(jid))
+
+    def save(self, owner, jid, item_state, db_state):
+        """ Save or remove roster item
+        """
+        owner, jid = (unicode(owner), unicode(jid))
+        with self.lock:
+            if self.closed:
+                return
+            items = self.ownerItems(owner)
+            if item_state.get('removed'):
+                items.pop(jid, None)
+                self.db.execute('delete from roster where owner = ? and jid = ?', (owner, jid))
+            else:
+                items[jid] = dict(item_state)
+                self.db.execute('insert or replace into roster (owner, jid, state) values (?, ?, ?)',
+                    (owner, jid, json.dumps(item_state)))
+            self.unsaved += 1
+            if self.unsaved >= COMMITEVERY:
+                self.commit()
+
+    def version(self, owner):
+        """ Return written roster version of owner, empty string if unknown
+        """
+        with self.lock:
+            if self.closed:
+                return u''
+            row = self.db.execute('select ver from versions where owner = ?', (unicode(owner),)).fetchone()
+        return u'' if row is None else row[0]
+
+    def set_version(self, owner, version):
+        """ Hold roster version of owner until commitVersion
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.versions[unicode(owner)] = version
+
+    def commitVersion(self, owner):
+        """ Write held version of owner and commit it with saved items,
+        call when roster result is applied completely
+        """
+        with self.lock:
+            if self.closed:
+                return
+            version = self.versions.pop(unicode(owner), None)
+            if version is not None:
+                self.db.execute('insert or replace into versions (owner, ver) values (?, ?)',
+                    (unicode(owner), version))
+            self.commit()
+
+    def commit(self):
+        """ Commit saved items, call with lock held
+        """
+        self.db.commit()
+        self.unsaved = 0
+
+    def close(self):
+        """ Commit saved items and close file, held versions are not written;
+        later calls of store do nothing
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.commit()
+            self.db.close()
+#class RosterStore(object):
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# (c) Valik mailto:vasnake@gmail.com
+
+u''' HTTP/JSON translit service, same request path as bot: modes from bot session store,
+translit cache, metrics. HTTP/1.1 keep-alive, connection is served by own thread.
+
+POST /translit  {"text": "Цой", "mode": "bgn", "user": "a@example.com"}
+    -> {"mode": "bgnpcgn", "text": "TSoy"}
+    mode is translation name, encoder name or its prefix, as in bot commands;
+    without mode, mode of user is taken from session store, driver license by default;
+    mode "all" gives {"mode": "all", "texts": {"encoder name": "text", ...}}
+POST /batch  {"mode": "bgn", "user": "...", "items": ["Цой", {"text": "Щукин", "mode": "gostr"}, ...]}
+    -> {"results": [{"mode": "bgnpcgn", "text": "TSoy"}, {"error": "..."}, ...]}
+    item mode overrides request mode; items of one mode are encoded in one pass
+POST /chat  {"user": "a@example.com", "text": ":bgn"}
+    -> {"reply": "..."}, reply of bot to chat message, commands change user mode
+GET /metrics
+    metrics in Prometheus text format
+Errors: status 400, 404, 413 with {"error": "..."}
+
+Run with bot or instead of it
+$ export TRANSBOT_HTTP_PORT=8080
+$ export TRANSBOT_XMPP=0
+$ python -m translitbot
+$ curl -d '{"text": "Цой"}' http://127.0.0.1:8080/translit
+
+
+Copyright 2012-2014 Valentin Fedulov
+
+This file is part of Translitbot.
+
+Translitbot is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Translitbot is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Translitbot. If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import json
+import time
+import logging
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import translitbot.enc as enc
+import translitbot.metrics as metrics
+import translitbot.translit_xmpp_bot as bot
+
+PORT = int(os.environ.get("TRANSBOT_HTTP_PORT", "0"))
+HOST = os.environ.get("TRANSBOT_HTTP_HOST", "127.0.0.1")
+# service address, no service if port is 0
+XMPP = os.environ.get("TRANSBOT_XMPP", "1") != "0"
+# XMPP client runs along with service, service only if 0
+
+MAXBODY = int(os.environ.get("TRANSBOT_HTTP_MAXBODY", "1048576"))
+# request body limit, bytes; each text is limited by bot MAXINPUT chars
+IDLE = 60
+# seconds, keep-alive connection closed if idle
+
+REQUESTS = metrics.Counter('transbot_http_requests_total', 'HTTP requests, by path and status',
+    ('path', 'code'))
+LATENCY = metrics.Histogram('transbot_http_seconds', 'HTTP request time, by path', ('path',))
+ITEMS = metrics.Counter('transbot_http_items_total', 'Texts encoded, by path', ('path',))
+
+LOG = logging.getLogger(__name__)
+
+
+def checkText(text):
+    """ Return text if it is string of allowed size, else raise ValueError
+    """
+    if not isinstance(text, basestring):
+        raise ValueError(u'text must be string')
+    if len(text) > bot.MAXINPUT:
+        raise ValueError(u'text is too long, limit is %d chars' % bot.MAXINPUT)
+    return text
+
+
+def checkUser(user):
+    """ Return user if it is string or None, else raise ValueError
+    """
+    if user is not None and not isinstance(user, basestring):
+        raise ValueError(u'user must be string')
+    return user
+
+
+def requestMode(name, user=None):
+    """ Return mode by name, or mode of user if name is empty,
+    raise ValueError if name is unknown
+    """
+    if not name:
+        return bot.userMode(user) if user else enc.DRIVELICMODE
+    mode = bot.getTransKey(u'%s' % name)
+    if mode is None:
+        raise ValueError(u"unknown mode '%s'" % name)
+    return mode
+
+
+def result(mode, outStr):
+    """ Return JSON dict for encoded text
+    """
+    if mode == bot.ALLMODE:
+        return {'mode': mode[1], 'texts': dict((key[1], value) for key, value in outStr.items())}
+    return {'mode': mode[1], 'text': outStr}
+
+
+def translitRequest(data):
+    u""" /translit: encode one text
+
+    >>> translitRequest({'text': u'Цой', 'mode': u'bgn'})
+    {'text': u'TSoy', 'mode': 'bgnpcgn'}
+    """
+    mode = requestMode(data.get('mode'), checkUser(data.get('user')))
+    ITEMS.inc(('/translit',))
+    return result(mode, bot.translitText(checkText(data.get('text')), mode))
+
+
+def batchRequest(data):
+    u""" /batch: encode list of texts, items of one mode encoded by one call.
+    Item is text or dict with text and mode, bad item gives error in its place.
+
+    >>> res = batchRequest({'mode': u'bgn', 'items': [u'Цой', {'text': u'Цой', 'mode': u'gostr'}, 1]})
+    >>> res['results']
+    [{'text': u'TSoy', 'mode': 'bgnpcgn'}, {'text': u'TCOI', 'mode': 'gostr'}, {'error': u'text must be string'}]
+    """
+    items = data.get('items')
+    if not isinstance(items, list):
+        raise ValueError(u'items must be list')
+    default = data.get('mode')
+    user = checkUser(data.get('user'))
+
+    res = [None] * len(items)
+    groups = {}
+    # mode: ([item index], [text])
+    for idx, item in enumerate(items):
+        try:
+            if isinstance(item, dict):
+                mode, text = (requestMode(item.get('mode') or default, user), checkText(item.get('text')))
+            else:
+                mode, text = (requestMode(default, user), checkText(item))
+        except ValueError as err:
+            res[idx] = {'error': unicode(err)}
+            continue
+        group = groups.setdefault(mode, ([], []))
+        group[0].append(idx)
+        group[1].append(text)
+
+    ITEMS.inc(('/batch',), len(items))
+    for mode, (indexes, texts) in groups.items():
+        for idx, outStr in zip(indexes, bot.translitMany(texts, mode)):
+            res[idx] = result(mode, outStr)
+    return {'results': res}
+#def batchRequest(data):
+
+
+def chatRequest(data):
+    u""" /chat: bot reply to message text of user
+
+    >>> print chatRequest({'user': u'doctest@example.com', 'text': u':bgn'})['reply']
+    Установлен режим транслитерации по методу 'BGN/PCGN (1944)'
+    """
+    user = checkUser(data.get('user'))
+    if not user:
+        raise ValueError(u'user must be string')
+    return {'reply': bot.makeResponce(user, checkText(data.get('text')))}
+
+
+ENDPOINTS = {
+    '/translit': translitRequest,
+    '/batch': batchRequest,
+    '/chat': chatRequest,
+}
+# path: function(request dict), returns responce dict
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    u""" HTTP/1.1 request handler: JSON requests to ENDPOINTS, metrics.
+    Connection is kept open until client closes it or it is idle for IDLE seconds.
+    """
+    protocol_version = 'HTTP/1.1'
+    server_version = 'translitbot'
+    timeout = IDLE
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        started = time.time()
+        path = self.path.split('?', 1)[0]
+        if path == '/metrics':
+            code = 200
+            self.respond(code, metrics.render().encode('utf-8'),
+                'text/plain; version=0.0.4; charset=utf-8')
+        else:
+            code = self.respondJSON(404, {'error': u'not found'})
+        self.record(path, code, started)
+
+    def do_POST(self):
+        started = time.time()
+        path = self.path.split('?', 1)[0]
+        endpoint = ENDPOINTS.get(path)
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if endpoint is None or length < 0 or length > MAXBODY:
+            # body is not read, connection can't be reused
+            self.close_connection = 1
+            if endpoint is None:
+                code = self.respondJSON(404, {'error': u'not found'})
+            elif length < 0:
+                code = self.respondJSON(400, {'error': u'bad Content-Length'})
+            else:
+                code = self.respondJSON(413, {'error': u'request is too large, limit is %d bytes' % MAXBODY})
+            return self.record(path, code, started)
+
+        body = self.rfile.read(length)
+        try:
+            data = json.loads(body.decode('utf-8'))
+            if not isinstance(data, dict):
+                raise ValueError(u'request must be JSON object')
+            code = self.respondJSON(200, endpoint(data))
+        except ValueError as err:
+            code = self.respondJSON(400, {'error': unicode(err)})
+        except Exception:
+            LOG.exception(u'Handler.do_POST failed')
+            code = self.respondJSON(500, {'error': u'internal error'})
+        self.record(path, code, started)
+    #def do_POST(self):
+
+    def respondJSON(self, code, data):
+        """ Send data as JSON, return code
+        """
+        self.respond(code, json.dumps(data, ensure_ascii=False).encode('utf-8'),
+            'application/json; charset=utf-8')
+        return code
+
+    def respond(self, code, body, ctype):
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def record(self, path, code, started):
+        """ Record request in metrics
+        """
+        label = path if path in ENDPOINTS or path == '/metrics' else 'other'
+        REQUESTS.inc((label, str(code)))
+        LATENCY.observe(time.time() - started, (label,))
+
+    def log_message(self, fmt, *args):
+        LOG.debug(u'%s %s', self.address_string(), fmt % args)
+#class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    u""" HTTP server, thread for each connection
+
+    >>> import httplib
+    >>> server = serve(0)
+    >>> conn = httplib.HTTPConnection('127.0.0.1', server.server_port)
+    >>> for body in ('{"text": "Shhi", "mode": "bgn"}', '{"items": ["a", "b"]}', '[]'):
+    ...     conn.request('POST', '/translit' if 'text' in body else '/batch', body)
+    ...     resp = conn.getresponse()
+    ...     print resp.status, resp.read()
+    200 {"text": "Shhi", "mode": "bgnpcgn"}
+    200 {"results": [{"text": "a", "mode": "driverlic"}, {"text": "b", "mode": "driverlic"}]}
+    400 {"error": "request must be JSON object"}
+    >>> conn.request('POST', '/batch', '{"items": ["a"], "user": 1}'); print conn.getresponse().read()
+    {"error": "user must be string"}
+    >>> for length in ('-1', 'x', str(MAXBODY + 1)):
+    ...     conn = httplib.HTTPConnection('127.0.0.1', server.server_port)
+    ...     conn.putrequest('POST', '/translit'); conn.putheader('Content-Length', length); conn.endheaders()
+    ...     resp = conn.getresponse()
+    ...     print resp.status, resp.read()
+    400 {"error": "bad Content-Length"}
+    400 {"error": "bad Content-Length"}
+    413 {"error": "request is too large, limit is 1048576 bytes"}
+    >>> conn.close(); server.shutdown(); server.server_close()
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(port=PORT, host=HOST, block=False):
+    """ Start service, return server. Requests are served in background thread,
+    or in this thread until shutdown if block
+    """
+    server = Server((host, port), Handler)
+    LOG.info(u'translit service on http://%s:%s/', host, server.server_port)
+    if block:
+        server.serve_forever()
+        return server
+    thread = threading.Thread(target=server.serve_forever, name='service')
+    thread.daemon = True
+    thread.start()
+    return server
+#def serve(port=PORT, host=HOST, block=False):
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# (c) Valik mailto:vasnake@gmail.com
+
+u''' Per-user session store: bounded in-memory LRU/TTL tier over
+optional sqlite file. Writes are collected and flushed to file by
+background thread, so message handling never waits for disk.
+
+Copyright 2012-2014 Valentin Fedulov
+
+This file is part of Translitbot.
+
+Translitbot is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Translitbot is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Translitbot. If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import sys
+import time
+import sqlite3
+import threading
+
+import translitbot.cache as cache
+
+MISSING = object()
+# marker of value not found in memory
+
+
+class SessionStore(object):
+    u""" Dict-like store of user values (e.g. encoder name of user mode).
+    Memory holds no more than maxEntries recently used users, entry expires
+    ttl seconds after it was stored or loaded. If path given, values are kept in sqlite
+    file: reads on memory miss go to file, writes are queued and flushed
+    in batches every flushInterval seconds.
+    Without file memory is the only copy, so maxEntries and ttl are ignored
+    and values are never dropped.
+
+    >>> store = SessionStore(maxEntries=1, ttl=0)
+    >>> store[u'a@example.com'] = u'bgnpcgn'; store[u'b@example.com'] = u'gostr'
+    >>> print store.get(u'a@example.com'), store.get(u'b@example.com')
+    bgnpcgn gostr
+    >>> import tempfile, shutil
+    >>> tmpdir = tempfile.mkdtemp()
+    >>> store = SessionStore(os.path.join(tmpdir, 'sessions.sqlite'), maxEntries=1)
+    >>> store[u'a@example.com'] = u'bgnpcgn'; store[u'b@example.com'] = u'gostr'
+    >>> print store.get(u'a@example.com'), store.get(u'c@example.com')
+    bgnpcgn None
+    >>> store.close()
+    >>> store = SessionStore(os.path.join(tmpdir, 'sessions.sqlite'))
+    >>> print store.get(u'b@example.com')
+    gostr
+    >>> store.close(); shutil.rmtree(tmpdir)
+    """
+
+    def __init__(self, path=None, maxEntries=10000, ttl=None, flushInterval=5.0):
+        if not path:
+            maxEntries, ttl = (sys.maxsize, None)
+        self.path = path
+        self.ttl = ttl
+        self.flushInterval = flushInterval
+        self.memory = cache.LRUCache(maxEntries)
+        self.pending = {}
+        self.flushing = {}
+        self.lock = threading.Lock()
+        self.dblock = threading.Lock()
+        self.db = None
+        self.writer = None
+        self.wakeup = threading.Event()
+        self.closed = False
+        if path:
+            dirname = os.path.dirname(path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('create table if not exists sessions (user text primary key, value text)')
+            self.db.commit()
+            self.writer = threading.Thread(target=self.writeLoop, name='SessionStore.writer')
+            self.writer.daemon = True
+            self.writer.start()
+
+    def get(self, user, default=None):
+        """ Return value for user, default if not found
+        """
+        item = self.memory.get(user, MISSING)
+        if item is not MISSING:
+            value, expires = item
+            if expires is None or expires > time.time():
+                return value
+        if self.db is None:
+            return default
+        with self.lock:
+            value = self.pending.get(user, self.flushing.get(user, MISSING))
+        if value is MISSING:
+            with self.dblock:
+                row = self.db.execute('select value from sessions where user = ?', (user,)).fetchone()
+            value = default if row is None else row[0]
+        self.remember(user, value)
+        return value
+
+    def __setitem__(self, user, value):
+        self.remember(user, value)
+        if self.db is not None:
+            with self.lock:
+                self.pending[user] = value
+
+    def remember(self, user, value):
+        """ Put value to memory tier
+        """
+        self.memory[user] = (value, None if self.ttl is None else time.time() + self.ttl)
+
+    def flush(self):
+        """ Write queued values to file in one transaction
+        """
+        if self.db is None:
+            return
+        with self.lock:
+            batch, self.pending, self.flushing = (self.pending, {}, self.pending)
+        if batch:
+            with self.dblock:
+                with self.db:
+                    self.db.executemany('insert or replace into sessions (user, value) values (?, ?)',
+                        batch.items())
+        with self.lock:
+            self.flushing = {}
+
+    def writeLoop(self):
+        """ Writer thread: flush queued values every flushInterval seconds until closed
+        """
+        while not self.closed:
+            self.wakeup.wait(self.flushInterval)
+            self.wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """ Stop writer thread, flush queued values and close file
+        """
+        self.closed = True
+        if self.writer is not None:
+            self.wakeup.set()
+            self.writer.join()
+            self.writer = None
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def stats(self):
+        """ Return dict with memory tier counters and number of queued writes
+        """
+        res = self.memory.stats()
+        res['pending'] = len(self.pending)
+        return res
+#class SessionStore(object):
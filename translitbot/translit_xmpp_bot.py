@@ -48,79 +48,288 @@ along with Translitbot. If not, see <http://www.gnu.org/licenses/>.
 
 import sys
 import os
+import io
+import copy
 import string
 import time
+import random
+import logging
+import itertools
+import collections
 import traceback
 
 import sleekxmpp
 
 import translitbot.enc as enc
+import translitbot.cache as cache
+import translitbot.session as session
+import translitbot.pipeline as pipeline
+import translitbot.ratelimit as ratelimit
+import translitbot.logger as logger
+import translitbot.metrics as metrics
+import translitbot.roster as roster
+
+LOG = logging.getLogger(__name__)
 
 USER = os.environ.get("TRANSBOT_USER", "google account name@gmail.com")
 PASSWORD = os.environ.get("TRANSBOT_PASSWORD", "google account passphrase")
 SERVER = os.environ.get("TRANSBOT_SERVER", "gmail.com")
 
+CACHE_ENTRIES = int(os.environ.get("TRANSBOT_CACHE_ENTRIES", "0"))
+CACHE_BYTES = int(os.environ.get("TRANSBOT_CACHE_BYTES", str(16 * 1024 * 1024)))
+CACHE_MAXLEN = int(os.environ.get("TRANSBOT_CACHE_MAXLEN", "1000"))
+# translit results cache, off if CACHE_ENTRIES is 0
+
+SESSIONS_PATH = os.environ.get("TRANSBOT_SESSIONS", "")
+SESSIONS_ENTRIES = int(os.environ.get("TRANSBOT_SESSIONS_ENTRIES", "10000"))
+SESSIONS_TTL = int(os.environ.get("TRANSBOT_SESSIONS_TTL", "86400"))
+# user modes: sqlite file (memory only if empty), users kept in memory, seconds in memory;
+# without file all users are kept in memory, entries and seconds are not used
+
+WORKERS = int(os.environ.get("TRANSBOT_WORKERS", "4"))
+QUEUE = int(os.environ.get("TRANSBOT_QUEUE", "100"))
+OVERLOAD = os.environ.get("TRANSBOT_OVERLOAD", pipeline.BUSY)
+# message pipeline: worker threads, queued messages per worker, policy: drop, defer, busy
+
+RATE = float(os.environ.get("TRANSBOT_RATE", "1"))
+BURST = int(os.environ.get("TRANSBOT_BURST", "10"))
+MAXINPUT = int(os.environ.get("TRANSBOT_MAXINPUT", "100000"))
+# messages per second and burst of messages for one user, hard limit of message size in chars
+
+REPLYCHUNK = int(os.environ.get("TRANSBOT_REPLYCHUNK", "4000"))
+# long answer is sent as several messages of no more than that many chars,
+# long text is encoded chunk by chunk while parts are sent
+
+RETRY_BASE = float(os.environ.get("TRANSBOT_RETRY_BASE", "1"))
+RETRY_MAX = float(os.environ.get("TRANSBOT_RETRY_MAX", "60"))
+STABLE = 60
+# reconnect pause: first, max in seconds; connection lasted STABLE seconds resets pause
+
+STREAMMANAGEMENT = os.environ.get("TRANSBOT_SM", "1") == "1"
+RESUME_ATTEMPTS = int(os.environ.get("TRANSBOT_RESUME_ATTEMPTS", "5"))
+# XEP-0198 stream management: acks, resume of broken stream without new login;
+# reconnect attempts made by sleekxmpp to resume stream, before main takes over
+
+ROSTER_PATH = os.environ.get("TRANSBOT_ROSTER", "")
+# sqlite file for roster cache, roster is requested in full on each start if empty
+
+OUTBOX = collections.deque(maxlen=int(os.environ.get("TRANSBOT_OUTBOX", "1000")))
+# (jid, text) replies made while disconnected, sent after reconnect
+
+BUSYTEXT = u"Слишком много сообщений, попробуйте позже"
+RATETEXT = u"Слишком много сообщений, подождите %d сек."
+SIZETEXT = u"Слишком длинное сообщение, можно не больше %d символов"
+
 CP = 'utf-8'
 
-MODES = {}
-# translit modes for users
+MODES = session.SessionStore(SESSIONS_PATH, SESSIONS_ENTRIES, SESSIONS_TTL)
+# translit modes for users, encoder names stored
+
+ALLMODE = (u'all', 'all')
+# pseudo mode: translit by all encoders at once
+
+MESSAGES = metrics.Counter('transbot_messages_total', 'Chat messages received, by result',
+    ('result',))
+RESPONCE = metrics.Histogram('transbot_responce_seconds', 'Time to first part of responce')
+TRANSLIT = metrics.Histogram('transbot_translit_seconds', 'Translit time, by encoder', ('mode',))
+SEND = metrics.Histogram('transbot_send_seconds', 'Reply send time')
+
+TRANSCACHE = None
+if CACHE_ENTRIES > 0:
+    TRANSCACHE = cache.TranslitCache(CACHE_ENTRIES, CACHE_BYTES, CACHE_MAXLEN)
+
+
+HELPCOMMANDS = frozenset([u'?', u'help', u':help'])
+# lowercased messages answered by usage text
 
 
 def usage():
     """ Help message """
     txt = u"Присылайте команду или текст. Команды начинаются с символа ':' и могут быть такими"
     txt += u"\n%s" % u'help'
+    txt += u"\n%s" % ALLMODE[0]
     for encname, enccode in sorted(enc.TRANSTABS.keys()):
-        txt += u"\n%s" % encname
+        txt += u"\n%s (:%s)" % (encname, enccode)
     return txt
 #def usage():
 
 
+HELP = usage()
+# prerendered help message
+
+COMMANDS = enc.modeIndex(enc.TRANSTABS.keys() + [ALLMODE])
+# command index, see getTransKey
+
+
 def getTransKey(transname):
-    """ Return None or tuple ('translation name', 'encoder name')
-    from encoders
+    u""" Return None or tuple ('translation name', 'encoder name')
+    from encoders, see enc.modeIndex
+
+    >>> getTransKey(u'bgn') == enc.BGNMODE, getTransKey(u'al'), getTransKey(u'all') == ALLMODE
+    (True, None, True)
     """
-    for encname, enccode in enc.TRANSTABS.keys():
-        if transname.lower() == encname.lower():
-            return (encname, enccode)
-    return None
+    return COMMANDS.get(transname.strip().lower())
 #def getTransKey(inStr):
 
 
 def makeResponce(userName, inStr):
-    """Return responce (string) to input message inStr for user userName.
+    u"""Return responce (string) to input message inStr for user userName,
+    whole answer in one string, see makeReplies.
+
+    >>> print makeResponce(u'doctest', u':bgn')
+    Установлен режим транслитерации по методу 'BGN/PCGN (1944)'
+    >>> print makeResponce(u'doctest', u':all')
+    Установлен режим транслитерации по методу 'all'
+    >>> res = makeResponce(u'doctest', u'Цой')
+    >>> print res.splitlines()[1]
+    ALA-LC: T͡Soĭ
+    """
+    return u''.join(makeReplies(userName, inStr, 0))
+
+
+def makeReplies(userName, inStr, size=REPLYCHUNK):
+    u"""Generator, yield responce to input message inStr for user userName
+    in parts of no more than size chars (one part if size is 0), each part is message body.
+    Text longer than size is encoded chunk by chunk (mode by mode for ALLMODE),
+    so first parts are sent before whole text is encoded, see boundedParts.
+    Joined parts give makeResponce.
+
+    >>> MODES[u'doctest.parts'] = enc.BGNMODE[1]
+    >>> text = u'щи да каша ' * 4
+    >>> list(makeReplies(u'doctest.parts', text, 60))
+    [u"Mode 'BGN/PCGN (1944)', answer is:\\nshchi da kasha shchi da ", u'kasha shchi da kasha shchi da kasha']
+    >>> u''.join(makeReplies(u'doctest.parts', text, 60)) == makeResponce(u'doctest.parts', text)
+    True
+    >>> MODES[u'doctest.parts'] = ALLMODE[1]
+    >>> parts = list(makeReplies(u'doctest.parts', text, 60))
+    >>> max(len(part) for part in parts) <= 60, u''.join(parts) == makeResponce(u'doctest.parts', text)
+    (True, True)
     """
     res = u''
 
     userName, inStr = (userName.strip(), inStr.strip())
-    print(u"user '%s' say '%s'" % (userName, inStr))
+    LOG.debug(u"user '%s' say %s", userName, logger.Payload(inStr))
 
     # empty input
     if not inStr or inStr.lower() == u'none':
-        return res
+        return
 
     # help commands
-    if inStr == u'?' or inStr.lower() == u'help' or inStr.lower() == u':help':
-        res = usage()
-        return res
+    if inStr.lower() in HELPCOMMANDS:
+        res = HELP
 
     # set mode command
-    if inStr[0] == u':':
+    elif inStr[0] == u':':
         mode = getTransKey(inStr[1:])
         if mode:
-            MODES[userName] = mode
+            MODES[userName] = mode[1]
             res = u"Установлен режим транслитерации по методу '%s'" % mode[0]
-            return res
         else:
             res = u"Незнакомая команда '%s'" % inStr
-            return res
 
     # translit text
-    mode = MODES.get(userName, enc.DRIVELICMODE)
-    outStr = enc.translit(inStr, mode)
-    res = u"Mode '%s', answer is:\n%s" % (mode[0], outStr)
+    else:
+        mode = userMode(userName)
+        stream = size and len(inStr) > size
+        if mode == ALLMODE:
+            header = u"All modes, answer is:"
+            if stream:
+                pieces = itertools.chain.from_iterable(
+                    itertools.chain([u"\n%s: " % key[0]], streamText(inStr, key, size))
+                    for key in sorted(enc.TRANSTABS))
+            else:
+                pieces = [u"\n%s: %s" % (key[0], outStr)
+                    for key, outStr in sorted(translitText(inStr, ALLMODE).items())]
+        else:
+            header = u"Mode '%s', answer is:\n" % mode[0]
+            pieces = streamText(inStr, mode, size) if stream else [translitText(inStr, mode)]
+        for part in boundedParts(pieces, size, header):
+            yield part
+        return
+
+    for part in boundedParts([res], size):
+        yield part
+#def makeReplies(userName, inStr, size=REPLYCHUNK):
+
+
+def boundedParts(pieces, size, header=u''):
+    u""" Generator, yield header and text of pieces in parts of no more than size chars
+    (no limit if 0), part is cut after last line end in its second half, or else after last space there;
+    first part is not cut inside header, so header never goes alone.
+    Joined parts give header and joined pieces.
+
+    >>> list(boundedParts([u'ab cd', u' ef\\ngh', u' ij'], 6))
+    [u'ab cd ', u'ef\\ngh ', u'ij']
+    >>> list(boundedParts([u'a bc'], 8, u'head:\\n'))
+    [u'head:\\na ', u'bc']
+    """
+    pending, start = (header, len(header))
+    for piece in pieces:
+        pending += piece
+        while size and len(pending) > size:
+            start = max(size // 2, min(start, size - 1))
+            cut = (pending.rfind(u'\n', start, size) + 1 or
+                pending.rfind(u' ', start, size) + 1 or size)
+            yield pending[:cut]
+            pending, start = (pending[cut:], 0)
+    if pending:
+        yield pending
+#def boundedParts(pieces, size):
+
+
+def userMode(userName):
+    """ Return translit mode of user from session store, driver license mode by default
+    """
+    return getTransKey(MODES.get(userName, enc.DRIVELICMODE[1])) or enc.DRIVELICMODE
+
+
+def translitText(inStr, mode):
+    """ Return inStr encoded by mode, through TRANSCACHE if enabled;
+    dict {mode: encoded string} for ALLMODE. Time recorded in TRANSLIT.
+    """
+    started = time.time()
+    if mode == ALLMODE:
+        res = enc.translit_all(inStr)
+    elif TRANSCACHE is None:
+        res = enc.translit(inStr, mode)
+    else:
+        res = TRANSCACHE.translit(inStr, mode)
+    TRANSLIT.observe(time.time() - started, (mode[1],))
+    return res
+
+
+def translitMany(texts, mode):
+    """ Return list of texts encoded by mode, same as translitText for each text.
+    Without cache texts are encoded in one pass by enc.translit_many.
+    Time of whole list recorded in TRANSLIT.
+    """
+    started = time.time()
+    if mode == ALLMODE:
+        res = [enc.translit_all(inStr) for inStr in texts]
+    elif TRANSCACHE is None:
+        res = enc.translit_many(texts, mode)
+    else:
+        res = [TRANSCACHE.translit(inStr, mode) for inStr in texts]
+    TRANSLIT.observe(time.time() - started, (mode[1],))
     return res
-#def makeResponce(userName, inStr):
+#def translitMany(texts, mode):
+
+
+def streamText(inStr, mode, size):
+    """ Generator, yield inStr encoded by mode in chunks of about size chars of input,
+    see enc.translit_stream. Encode time of whole text recorded in TRANSLIT,
+    time of consumer is not counted.
+    """
+    spent = 0.0
+    chunks = enc.translit_stream(io.StringIO(inStr), mode, size)
+    while True:
+        started = time.time()
+        outStr = next(chunks, None)
+        spent += time.time() - started
+        if outStr is None:
+            break
+        yield outStr
+    TRANSLIT.observe(spent, (mode[1],))
 
 
 class TranslitBot(sleekxmpp.ClientXMPP):
@@ -131,64 +340,223 @@ class TranslitBot(sleekxmpp.ClientXMPP):
         sleekxmpp.ClientXMPP.__init__(self, jid, password)
 
         self.add_event_handler("session_start", self.start)
+        self.add_event_handler("session_resumed", self.resumed)
+        self.add_event_handler("connection_failed", self.failed)
+        self.add_event_handler("sm_failed", self.resumeFailed)
+        self.add_event_handler("disconnected", self.disconnected)
         self.add_event_handler("message", self.message)
+        # roster is applied in own thread, messages are not waiting for large roster
+        self.del_event_handler("roster_update", self._handle_roster)
+        self.add_event_handler("roster_update", self.rosterUpdated, threaded=True)
+
+        self.rosterStore = None
+        if ROSTER_PATH:
+            self.rosterStore = roster.RosterStore(ROSTER_PATH)
+            self.roster.set_backend(self.rosterStore, save=False)
+        self.rosterRequested = None
+
+        # with stream management broken stream is resumed by sleekxmpp reconnect,
+        # if it fails, or without stream management, reconnect is done by main
+        self.auto_reconnect = STREAMMANAGEMENT
+        self.reconnect_max_delay = RETRY_MAX
+        self.reconnect_max_attempts = RESUME_ATTEMPTS
+        self.online = False
+        self.inflight = []
 
         # https://github.com/fritzy/SleekXMPP/wiki/Roster-Management
         self.auto_authorize = True
         self.auto_subscribe = True
 
+        self.pipeline = pipeline.Pipeline(self.reply, WORKERS, QUEUE, OVERLOAD, self.busy)
+        self.limiter = ratelimit.RateLimiter(RATE, BURST, SESSIONS_ENTRIES)
+        metrics.Gauge('transbot_queue_depth', 'Messages waiting in pipeline queues',
+            lambda: self.pipeline.stats()['depth'])
+
 
     def start(self, event):
         self.send_presence()
-        self.get_roster()
+        # roster is not needed for replies, don't wait for it;
+        # with cached roster version server sends only changes
+        self.rosterRequested = time.time()
+        self.get_roster(block=False)
+        # new session: replies not acked in broken stream are sent again
+        OUTBOX.extendleft(reversed(self.inflight))
+        self.inflight = []
+        self.flush()
+
+    def resumed(self, event):
+        # unacked stanzas are sent again by xep_0198 plugin
+        LOG.info(u"stream resumed, %d replies not acked", len(self.inflight))
+        self.inflight = []
+        self.flush()
+
+    def rosterUpdated(self, iq):
+        """ Apply roster result or push
+        """
+        self._handle_roster(iq)
+        if self.rosterStore is not None and iq['type'] == 'result':
+            # all items saved, version can be written
+            self.rosterStore.commitVersion(self.client_roster.jid)
+        if self.rosterRequested is not None and iq['type'] == 'result':
+            LOG.info(u"roster loaded in %.3f sec, %d contacts, version '%s'",
+                time.time() - self.rosterRequested, len(self.client_roster), self.client_roster.version)
+            self.rosterRequested = None
+
+    def flush(self):
+        """ Go online, send replies made while disconnected
+        """
+        self.online = True
+        if OUTBOX:
+            LOG.info(u"send %d replies made while disconnected", len(OUTBOX))
+        while OUTBOX:
+            jid, text = OUTBOX.popleft()
+            self.send_message(mto=jid, mbody=text, mtype='chat')
+
+    def disconnected(self, event):
+        self.online = False
+        if self.plugin.enabled('xep_0198'):
+            self.inflight = [(stanza['to'], stanza['body'])
+                for seq, stanza in self.plugin['xep_0198'].unacked_queue
+                if stanza.name == 'message' and stanza['body']]
+
+    def failed(self, event):
+        # reconnect attempts are over, stop processing, main will reconnect
+        LOG.warning(u"connection failed after %d attempts", self.reconnect_max_attempts)
+        self.auto_reconnect = False
+        self.set_stop()
+
+    def resumeFailed(self, event):
+        # server refused to resume stream (or enable stream management),
+        # replies not acked are sent again by start of new session
+        if self.plugin['xep_0198'].sm_id:
+            LOG.warning(u"unable to resume stream")
+        else:
+            LOG.warning(u"stream management not enabled by server")
+
+    def sendReply(self, msg, text):
+        """ Send text as reply to msg, put it to OUTBOX if disconnected
+        """
+        if self.online:
+            msg.reply(text).send()
+        else:
+            OUTBOX.append((msg['from'], text))
 
     def message(self, msg):
         try:
-            print(u"\n message type '%s'" % msg['type'])
+            LOG.debug(u"message type '%s'", msg['type'])
             if msg['type'] in ('chat', 'normal'):
-                print("make responce...")
-                resp = makeResponce(u'%s' % msg['from'], u'%s' % msg['body'])
-                if resp:
-                    print(u"responce is '%s'" % resp)
-                    msg.reply(resp).send()
+                user = u'%s' % msg['from'].bare
+                wait, inrow = self.limiter.take(user)
+                if wait:
+                    MESSAGES.inc(('ratelimit',))
+                    LOG.info(u"rate limit for '%s', rejected %d", user, inrow)
+                    if inrow == 1:
+                        self.sendReply(msg, RATETEXT % max(wait, 1))
+                elif len(msg['body']) > MAXINPUT:
+                    MESSAGES.inc(('toolong',))
+                    LOG.info(u"message of '%s' is too long: %d", user, len(msg['body']))
+                    self.sendReply(msg, SIZETEXT % MAXINPUT)
+                elif self.pipeline.submit(user, msg):
+                    MESSAGES.inc(('queued',))
                 else:
-                    print(u"responce is empty")
+                    MESSAGES.inc(('overload',))
             else:
-                print("service message, skip it")
+                LOG.debug(u"service message, skip it")
         except:
-            print u'TranslitBot.messge failed:'
-            traceback.print_exc(file=sys.stderr)
+            LOG.exception(u'TranslitBot.messge failed')
+
+    def reply(self, user, msg):
+        """ Pipeline worker: make responce to msg and send it,
+        long responce is sent part by part while it is made
+        """
+        started = time.time()
+        # reply changes stanza, each part is reply to copy of msg without body
+        template = copy.copy(msg)
+        del template['body']
+        parts = 0
+        for resp in makeReplies(u'%s' % msg['from'], u'%s' % msg['body']):
+            if not parts:
+                RESPONCE.observe(time.time() - started)
+            parts += 1
+            LOG.debug(u"responce part %d is %s", parts, logger.Payload(resp))
+            sent = time.time()
+            self.sendReply(copy.copy(template), resp)
+            SEND.observe(time.time() - sent)
+        if not parts:
+            LOG.debug(u"responce is empty")
+
+    def busy(self, user, msg):
+        """ Pipeline overload: tell user to wait
+        """
+        LOG.warning(u"queue is full, '%s' is busy", user)
+        self.sendReply(msg, BUSYTEXT)
 #class TranslitBot(sleekxmpp.ClientXMPP):
 
 
-def main():
-    """Infinite loop - create XMPP bot and connect it to server.
+def backoff(attempt, base=RETRY_BASE, cap=RETRY_MAX):
+    """ Return pause in seconds before reconnect attempt number attempt, 0 is first.
+    Pause is random (jitter) up to base * 2**attempt, but no more than cap,
+    so first retry is fast and bots of one server don't reconnect all at once.
+
+    >>> backoff(0) <= RETRY_BASE, backoff(100) <= RETRY_MAX
+    (True, True)
     """
+    return random.uniform(0, min(cap, base * 2 ** min(attempt, 32)))
+
+
+def connect():
+    """ Create XMPP bot, connect it to server and process messages until disconnect
+    """
+    xmpp = TranslitBot(USER, PASSWORD)
+    xmpp.register_plugin('xep_0030') # Service Discovery
+    xmpp.register_plugin('xep_0199') # XMPP Ping
+    if STREAMMANAGEMENT:
+        xmpp.register_plugin('xep_0198') # Stream Management
+    #~ xmpp.register_plugin('xep_0004') # Data Forms
+    #~ xmpp.register_plugin('xep_0060') # PubSub
+
     try:
-        xmpp = TranslitBot(USER, PASSWORD)
-        xmpp.register_plugin('xep_0030') # Service Discovery
-        xmpp.register_plugin('xep_0199') # XMPP Ping
-        #~ xmpp.register_plugin('xep_0004') # Data Forms
-        #~ xmpp.register_plugin('xep_0060') # PubSub
-
-        if xmpp.connect(): # if xmpp.connect(('talk.google.com', 5222)):
-            print("connected, process messages...")
+        if xmpp.connect(reattempt=False): # if xmpp.connect(('talk.google.com', 5222)):
+            LOG.info(u"connected, process messages...")
             xmpp.process(block=True)
-            print("xmpp.process done")
+            LOG.info(u"xmpp.process done")
         else:
-            print("unable to connect.")
+            LOG.error(u"unable to connect.")
+    finally:
+        xmpp.pipeline.stop()
+        if xmpp.rosterStore is not None:
+            xmpp.rosterStore.close()
+        # replies of broken stream go to next connection
+        OUTBOX.extendleft(reversed(xmpp.inflight))
+#def connect():
 
-    except (KeyboardInterrupt, SystemExit):
-        print u'shutdown...'
-        return
-    except:
-        print u'app exception, restart after pause...'
-        traceback.print_exc(file=sys.stderr)
 
-    # loop
-    print u"will wait and try again..."
-    time.sleep(61)
-    main()
+def main():
+    """Infinite loop - connect bot to server, reconnect after pause if disconnected.
+    """
+    attempt = 0
+    while True:
+        started = time.time()
+        try:
+            connect()
+        except (KeyboardInterrupt, SystemExit):
+            LOG.info(u'shutdown...')
+            MODES.close()
+            return
+        except:
+            LOG.exception(u'app exception, restart after pause...')
+
+        if time.time() - started > STABLE:
+            attempt = 0
+        pause = backoff(attempt)
+        attempt += 1
+        LOG.info(u"will wait %.1f sec and try again...", pause)
+        try:
+            time.sleep(pause)
+        except KeyboardInterrupt:
+            LOG.info(u'shutdown...')
+            MODES.close()
+            return
 #def main():
 
 